@@ -1,22 +1,72 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, session
+from quart import Quart, Response, render_template, request, redirect, url_for, flash, session, g
 from werkzeug.security import generate_password_hash, check_password_hash
-import json, io, os, sqlite3, re, textwrap
-from fpdf import FPDF
+import json, io, os, sqlite3, re, textwrap, hashlib, time, asyncio, random, copy, threading, glob
+from functools import lru_cache
+import aiosqlite
+from aiosqlitepool import SQLiteConnectionPool
+from fpdf import FPDF, FPDF_VERSION, XPos, YPos
+from fpdf.fonts import SubsetMap
+from fontTools import ttLib
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 
-app = Flask(__name__)
+app = Quart(__name__)
 app.secret_key = "supersecretkey"
 
 # --- Database Setup ---
 DATABASE = 'fir_portal.db'
-
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+
+# Applied once per pooled connection so the request path never pays for them
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Long-lived connections shared by all requests; opened when the server starts
+db_pool = None
+
+async def _connect_db():
+    # Autocommit: sqlite3 never opens transactions implicitly, so reads run
+    # bare and every write path starts its own BEGIN IMMEDIATE
+    conn = await aiosqlite.connect(DATABASE, isolation_level=None)
+    conn.row_factory = aiosqlite.Row
+    for pragma in DB_PRAGMAS:
+        await conn.execute(pragma)
     return conn
 
+@app.before_serving
+async def open_db_pool():
+    global db_pool
+    db_pool = SQLiteConnectionPool(_connect_db, pool_size=DB_POOL_SIZE)
+
+@app.after_serving
+async def close_db_pool():
+    await db_pool.close()
+
+async def get_db_connection():
+    # One pooled connection per request, handed back in close_db_connection.
+    # Code that may run outside a request, across a Gemini call or around
+    # CPU-bound asyncio.to_thread work uses db_pool.connection() directly instead.
+    if "db" not in g:
+        g.db_context = db_pool.connection()
+        g.db = await g.db_context.__aenter__()
+    return g.db
+
+@app.teardown_appcontext
+async def close_db_connection(exception):
+    g.pop("db", None)
+    db_context = g.pop("db_context", None)
+    if db_context is not None:
+        await db_context.__aexit__(None, None, None)
+
 def create_db_tables():
-    conn = get_db_connection()
+    conn = sqlite3.connect(DATABASE)
+    # journal_mode is persistent in the database file, so it is set once here
+    conn.execute("PRAGMA journal_mode=WAL")
     conn.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY,
@@ -45,14 +95,64 @@ def create_db_tables():
             status TEXT,
             laws TEXT,
             actions TEXT,
+            analysis_queued_at INTEGER,
+            analysis_started_at INTEGER,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    report_columns = [row[1] for row in conn.execute("PRAGMA table_info(fir_reports)")]
+    for column in ("analysis_queued_at", "analysis_started_at"):
+        if column not in report_columns:
+            conn.execute(f"ALTER TABLE fir_reports ADD COLUMN {column} INTEGER")
+    # Secondary indexes carry the rowid (fir_reports.id), so this one also serves
+    # "WHERE user_id = ? ORDER BY id" without a separate (user_id, id) index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fir_user ON fir_reports(user_id)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fir_analysis_cache (
+            key TEXT PRIMARY KEY,
+            laws TEXT NOT NULL,
+            actions TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL
+        )
+    ''')
+    cache_columns = [row[1] for row in conn.execute("PRAGMA table_info(fir_analysis_cache)")]
+    if "expires_at" not in cache_columns:
+        # Rows from before analyses expired are treated as already stale (except in replay mode)
+        conn.execute("ALTER TABLE fir_analysis_cache ADD COLUMN expires_at INTEGER NOT NULL DEFAULT 0")
     conn.commit()
     conn.close()
 
 create_db_tables()
 
+_INSERT_FIR_SQL = '''
+    INSERT INTO fir_reports (
+        user_id, name, company, company_address, industry, email, phone,
+        accused_name, accused_role, witness_name, witness_contact, location_details,
+        violation_type, incident_date, description, status, laws, actions,
+        analysis_queued_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+async def insert_firs(conn, rows):
+    # One write transaction and one commit for the whole batch; the identical
+    # SQL text lets sqlite3's statement cache reuse the prepared statement
+    await conn.execute("BEGIN IMMEDIATE")
+    await conn.executemany(_INSERT_FIR_SQL, rows)
+    # executemany leaves cursor.lastrowid unset, so ask SQLite directly
+    async with conn.execute("SELECT last_insert_rowid()") as cursor:
+        last_id = (await cursor.fetchone())[0]
+    await conn.commit()
+    return last_id
+
+_UPDATE_ANALYSIS_SQL = "UPDATE fir_reports SET status = ?, laws = ?, actions = ? WHERE id = ?"
+
+async def update_fir_analyses(conn, rows):
+    # rows are (status, laws, actions, fir_id); same single-transaction batching as insert_firs
+    await conn.execute("BEGIN IMMEDIATE")
+    await conn.executemany(_UPDATE_ANALYSIS_SQL, rows)
+    await conn.commit()
+
 # --- API Key Configuration ---
 api_key = os.getenv("GEN_API_KEY")
 DEFAULT_MODEL = os.getenv("GEN_MODEL", "gemini-1.5-flash")
@@ -64,274 +164,658 @@ FALLBACK_MODELS = [
     "gemini-1.0",
 ]
 
+# Static instructions travel as the model's system_instruction; each request
+# carries only the FIR description
+SYSTEM_INSTRUCTION = """You are a legal assistant. Your goal is to provide **brief, actionable, and human-readable** analysis.
+Analyze the FIR description you are given and provide a response that strictly adheres to the following format. Do not include any other text.
+The lists must be in **bullet-point format** and limited to **3-4 concise points** each.
+
+Suggested Laws:
+* [Relevant Indian law, section, and short description]
+* [...]
+
+Recommended Actions:
+* [Concise, actionable step]
+* [...]
+"""
+# The per-request part of the prompt; the preamble lives in SYSTEM_INSTRUCTION
+_PROMPT_TEMPLATE = 'Description: "{description}"'
+
+# One client per fallback model, built once and reused by every request
+MODELS = {}
 if api_key:
     print("API key found. Configuring Gemini.")
     genai.configure(api_key=api_key)
+    MODELS = {
+        name: genai.GenerativeModel(name, system_instruction=SYSTEM_INSTRUCTION)
+        for name in FALLBACK_MODELS if name
+    }
 else:
     print("API key not found. Gemini will not be configured.")
 
+# "replay" serves analyses only from fir_analysis_cache (ignoring expiry) and fails on a miss
+CACHE_MODE = os.getenv("CACHE_MODE", "")
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "86400"))
+
+# --- Gemini Rate Limiting (token bucket over requests and tokens per minute) ---
+# GEMINI_RPM/TPM are the account-wide quota. Every server worker process has its
+# own bucket, so each gets an equal share; WEB_CONCURRENCY is the worker count
+# (gunicorn reads the same variable, see Procfile).
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "15"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+WEB_CONCURRENCY = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+WORKER_RPM = GEMINI_RPM / WEB_CONCURRENCY
+WORKER_TPM = GEMINI_TPM / WEB_CONCURRENCY
+# A share below one request must still be able to hold one whole request
+REQUEST_BUCKET_SIZE = max(WORKER_RPM, 1)
+# Gemini bills the system instruction as input on every call, so it still
+# counts against TPM; ~4 characters per token plus the description wrapper
+PROMPT_TOKEN_OVERHEAD = len(SYSTEM_INSTRUCTION) // 4 + 16
+
+request_tokens = REQUEST_BUCKET_SIZE
+token_tokens = WORKER_TPM
+last_update = time.monotonic()
+rate_limit_lock = asyncio.Lock()
+
+def estimate_tokens(description):
+    return len(description or "") // 4 + PROMPT_TOKEN_OVERHEAD
+
+async def acquire(estimated_tokens):
+    global request_tokens, token_tokens, last_update
+    estimated_tokens = min(estimated_tokens, WORKER_TPM)
+    # Waiters queue on the lock, so callers are released in arrival order
+    async with rate_limit_lock:
+        while True:
+            now = time.monotonic()
+            elapsed = now - last_update
+            last_update = now
+            request_tokens = min(REQUEST_BUCKET_SIZE, request_tokens + elapsed * WORKER_RPM / 60)
+            token_tokens = min(WORKER_TPM, token_tokens + elapsed * WORKER_TPM / 60)
+
+            if request_tokens >= 1 and token_tokens >= estimated_tokens:
+                request_tokens -= 1
+                token_tokens -= estimated_tokens
+                return
+
+            wait_time = max(
+                (1 - request_tokens) * 60 / WORKER_RPM,
+                (estimated_tokens - token_tokens) * 60 / WORKER_TPM,
+            )
+            await asyncio.sleep(wait_time)
+
+# --- Gemini Retries (transient failures only; permanent ones fall through to the next model) ---
+MAX_GEMINI_ATTEMPTS = 5
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    TimeoutError,
+)
+
+async def generate_with_retry(model, prompt, estimated_tokens):
+    for attempt in range(MAX_GEMINI_ATTEMPTS):
+        await acquire(estimated_tokens)
+        try:
+            return await model.generate_content_async(prompt)
+        except RETRYABLE_ERRORS as e:
+            if attempt == MAX_GEMINI_ATTEMPTS - 1:
+                raise
+            delay = min(30, (2 ** attempt) + random.random())
+            print(f"Transient error from '{model.model_name}' (attempt {attempt + 1}): {e}. Retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
 # ---------------- Home ----------------
 @app.route("/")
-def home():
-    return render_template("index.html")
+async def home():
+    return await render_template("index.html")
 
 # ---------------- Register ----------------
+# Pinned to Werkzeug 3.x's current default (scrypt, N=2^15, r=8, p=1) so a
+# library upgrade can't silently change the cost. About 100ms of CPU and 32MB
+# of memory per register/login; existing hashes keep their own parameters.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+
 @app.route("/register", methods=["GET", "POST"])
-def register():
+async def register():
     if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
-        password_hash = generate_password_hash(password)
+        form = await request.form
+        username = form.get("username")
+        password = form.get("password")
+        # scrypt is deliberately slow; hash in a worker thread so the event loop stays free
+        password_hash = await asyncio.to_thread(generate_password_hash, password, method=PASSWORD_HASH_METHOD)
 
-        conn = get_db_connection()
+        conn = await get_db_connection()
         try:
-            conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
-            conn.commit()
-            flash("Registered successfully! Please login.", "success")
-            return redirect(url_for("login"))
+            await conn.execute("BEGIN IMMEDIATE")
+            await conn.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
+            await conn.commit()
         except sqlite3.IntegrityError:
-            flash("Username already exists.", "error")
-            conn.close()
-            return render_template("register.html")
-        finally:
-            conn.close()
+            await conn.rollback()
+            await flash("Username already exists.", "error")
+            return await render_template("register.html")
+
+        await flash("Registered successfully! Please login.", "success")
+        return redirect(url_for("login"))
 
-    return render_template("register.html")
+    return await render_template("register.html")
 
 # ---------------- Login ----------------
 @app.route("/login", methods=["GET", "POST"])
-def login():
+async def login():
     if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
+        form = await request.form
+        username = form.get("username")
+        password = form.get("password")
 
-        conn = get_db_connection()
-        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
-        conn.close()
+        # Released before the (slow) hash check so logins don't hold pool connections
+        async with db_pool.connection() as conn:
+            async with conn.execute("SELECT id, username, password_hash FROM users WHERE username = ?", (username,)) as cursor:
+                user = await cursor.fetchone()
 
-        if user and check_password_hash(user['password_hash'], password):
+        if user and await asyncio.to_thread(check_password_hash, user['password_hash'], password):
             session["user_id"] = user['id']
             session["user"] = user['username']
-            flash(f"Welcome {username}!", "success")
+            await flash(f"Welcome {username}!", "success")
             return redirect(url_for("dashboard"))
         else:
-            flash("Invalid credentials", "error")
+            await flash("Invalid credentials", "error")
 
-    return render_template("login.html")
+    return await render_template("login.html")
 
 # ---------------- Logout ----------------
 @app.route("/logout")
-def logout():
+async def logout():
     session.pop("user_id", None)
     session.pop("user", None)
-    flash("Logged out successfully!", "success")
+    await flash("Logged out successfully!", "success")
     return redirect(url_for("home"))
 
 # ---------------- Dashboard ----------------
+DASHBOARD_PAGE_SIZE = 20
+
 @app.route("/dashboard")
-def dashboard():
+async def dashboard():
     if "user_id" not in session:
-        flash("Please login first.", "error")
+        await flash("Please login first.", "error")
         return redirect(url_for("login"))
 
-    conn = get_db_connection()
-    # Fetch reports ordered by ID descending to get latest first
-    reports = conn.execute("SELECT * FROM fir_reports WHERE user_id = ? ORDER BY id DESC", (session['user_id'],)).fetchall()
-    conn.close()
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    conn = await get_db_connection()
+    # Only the latest FIR shows its analysis; the list needs summary columns only
+    async with conn.execute(
+        "SELECT id, name, company, violation_type, status, laws, actions FROM fir_reports WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (session['user_id'],)
+    ) as cursor:
+        latest_fir = await cursor.fetchone()
+    async with conn.execute("SELECT COUNT(*) FROM fir_reports WHERE user_id = ?", (session['user_id'],)) as cursor:
+        total = (await cursor.fetchone())[0]
+    # Past the last page would be empty anyway, and a huge ?page= overflows SQLite's OFFSET
+    last_page = max((total - 1 + DASHBOARD_PAGE_SIZE - 1) // DASHBOARD_PAGE_SIZE, 1)
+    page = min(page, last_page)
+    # Fetch reports ordered by ID descending, skipping the featured latest one
+    reports = await conn.execute_fetchall(
+        "SELECT id, company, violation_type, incident_date, status FROM fir_reports WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+        (session['user_id'], DASHBOARD_PAGE_SIZE, 1 + (page - 1) * DASHBOARD_PAGE_SIZE)
+    )
 
-    return render_template("dashboard.html", reports=reports)
+    previous_count = max(total - 1, 0)
+    has_next = 1 + page * DASHBOARD_PAGE_SIZE < total
+    return await render_template(
+        "dashboard.html", latest_fir=latest_fir, reports=reports,
+        previous_count=previous_count, page=page, has_next=has_next
+    )
 
 # ---------------- View Single FIR ----------------
 @app.route("/view_fir/<int:fir_id>")
-def view_fir(fir_id):
+async def view_fir(fir_id):
     if "user_id" not in session:
-        flash("Please login first.", "error")
+        await flash("Please login first.", "error")
         return redirect(url_for("login"))
 
-    conn = get_db_connection()
-    fir = conn.execute(
+    conn = await get_db_connection()
+    async with conn.execute(
         "SELECT * FROM fir_reports WHERE id = ? AND user_id = ?",
         (fir_id, session['user_id'])
-    ).fetchone()
-    conn.close()
+    ) as cursor:
+        fir = await cursor.fetchone()
 
     if not fir:
-        flash("Report not found or access denied.", "error")
+        await flash("Report not found or access denied.", "error")
         return redirect(url_for("dashboard"))
 
-    return render_template("view_fir.html", fir=fir)
+    return await render_template("view_fir.html", fir=fir)
 
 
 # ---------------- FIR Analysis ----------------
-def analyze_fir(description):
-    if not api_key:
-        print("API key is missing. Skipping AI analysis.")
-        return "Analysis failed: API key not configured.", "Try again later"
+_MARKDOWN_RE = re.compile(r'[\*\-]')
+
+# Editing the prompt changes every key, so analyses made with the old prompt stop being served
+PROMPT_FINGERPRINT = hashlib.blake2b(f"{SYSTEM_INSTRUCTION}|{_PROMPT_TEMPLATE}".encode(), digest_size=8).hexdigest()
+
+def analysis_cache_key(description):
+    # Case and whitespace differences should not cost another Gemini call
+    normalized = " ".join((description or "").lower().split())
+    return hashlib.blake2b(f"{DEFAULT_MODEL}|{PROMPT_FINGERPRINT}|{normalized}".encode(), digest_size=16).hexdigest()
+
+async def get_cached_analysis(key):
+    # Replay serves every recorded row, including pre-expiry ones migrated with expires_at = 0
+    not_expired_after = -1 if CACHE_MODE == "replay" else int(time.time())
+    async with db_pool.connection() as conn:
+        async with conn.execute(
+            "SELECT laws, actions FROM fir_analysis_cache WHERE key = ? AND expires_at > ?",
+            (key, not_expired_after)
+        ) as cursor:
+            row = await cursor.fetchone()
+    return (row['laws'], row['actions']) if row else None
+
+async def store_cached_analysis(key, suggested_laws, recommended_actions):
+    now = int(time.time())
+    async with db_pool.connection() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        await conn.execute(
+            "INSERT OR REPLACE INTO fir_analysis_cache (key, laws, actions, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, suggested_laws, recommended_actions, now, now + ANALYSIS_CACHE_TTL)
+        )
+        await conn.commit()
+
+@app.before_serving
+async def purge_expired_analyses():
+    # Replay mode depends on recorded rows, expired or not, so it keeps them all
+    if CACHE_MODE == "replay":
+        return
+    async with db_pool.connection() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        await conn.execute("DELETE FROM fir_analysis_cache WHERE expires_at <= ?", (int(time.time()),))
+        await conn.commit()
+
+def parse_analysis(text):
+    suggested_laws = "Analysis failed: Could not parse AI response."
+    recommended_actions = "Try again later"
+
+    # --- Extract and Clean the Content ---
+    if text:
+        before_laws, laws_sep, laws = text.partition("Suggested Laws:")
+        if laws_sep:
+            # The actions section normally follows the laws, but may come first
+            laws, actions_sep, actions = laws.partition("Recommended Actions:")
+            if not actions_sep:
+                _, actions_sep, actions = before_laws.partition("Recommended Actions:")
+            suggested_laws = laws
+            if actions_sep:
+                recommended_actions = actions
+        else:
+            suggested_laws = "See AI analysis below."
+            recommended_actions = text
 
-    prompt = f"""You are a legal assistant. Your goal is to provide **brief, actionable, and human-readable** analysis.
-Analyze this FIR description and provide a response that strictly adheres to the following format. Do not include any other text.
-The lists must be in **bullet-point format** and limited to **3-4 concise points** each.
+    # --- Post-process: Remove Markdown characters (*, -) and bolding (**) for cleaner display ---
+    suggested_laws = _MARKDOWN_RE.sub('', suggested_laws).strip()
+    recommended_actions = _MARKDOWN_RE.sub('', recommended_actions).strip()
+    return suggested_laws, recommended_actions
 
-Description: "{description}"
+async def ask_model(candidate, prompt, estimated_tokens):
+    model = MODELS[candidate]
+    started = time.monotonic()
+    try:
+        response = await generate_with_retry(model, prompt, estimated_tokens)
+        text = getattr(response, "text", None)
+        if not text:
+            text = str(response)
+    except asyncio.CancelledError:
+        print(f"AI attempt with model '{candidate}' cancelled after {time.monotonic() - started:.1f}s")
+        raise
+    except Exception as e:
+        print(f"AI attempt with model '{candidate}' failed after {time.monotonic() - started:.1f}s: {e!r}")
+        raise
+    print(f"AI attempt with model '{candidate}' succeeded in {time.monotonic() - started:.1f}s")
+    return parse_analysis(text)
+
+# Seconds to wait on an attempt before hedging with the next fallback model
+GEMINI_HEDGE_DELAY = float(os.getenv("GEMINI_HEDGE_DELAY", "8"))
+
+async def analyze_fir(description):
+    cache_key = analysis_cache_key(description)
+    cached = await get_cached_analysis(cache_key)
+    if cached:
+        return cached
+    if CACHE_MODE == "replay":
+        raise LookupError(f"No cached analysis for key {cache_key} (CACHE_MODE=replay)")
 
-Suggested Laws:
-* [Relevant Indian law, section, and short description]
-* [...]
+    if not api_key:
+        print("API key is missing. Skipping AI analysis.")
+        return "Analysis failed: API key not configured.", "Try again later"
 
-Recommended Actions:
-* [Concise, actionable step]
-* [...]
-"""
-    last_exception = None
+    prompt = _PROMPT_TEMPLATE.format(description=description)
+    estimated_tokens = estimate_tokens(description)
+    # MODELS keeps FALLBACK_MODELS order, without blanks or duplicates
+    candidates = iter(list(MODELS))
     tried = []
-    for candidate in FALLBACK_MODELS:
-        if not candidate:
-            continue
-        try:
-            tried.append(candidate)
-            model = genai.GenerativeModel(candidate)
-            response = model.generate_content(prompt)
-            text = getattr(response, "text", None)
-            if not text:
-                text = str(response)
-
-            suggested_laws = "Analysis failed: Could not parse AI response."
-            recommended_actions = "Try again later"
-
-            # --- Extract and Clean the Content ---
-            if text and "Suggested Laws:" in text and "Recommended Actions:" in text:
-                suggested_laws = text.split("Suggested Laws:")[1].split("Recommended Actions:")[0].strip()
-                recommended_actions = text.split("Recommended Actions:")[1].strip()
-            elif text:
-                # Fallback extraction logic
-                parts = text.split("Recommended Actions:")
-                if len(parts) == 2:
-                    suggested_laws = parts[0].replace("Suggested Laws:", "").strip()
-                    recommended_actions = parts[1].strip()
-                else:
-                    suggested_laws = "See AI analysis below."
-                    recommended_actions = text.strip()
+    pending = set()
+    last_exception = None
+    result = None
 
-            # --- Post-process: Remove Markdown characters (*, -) and bolding (**) for cleaner display ---
-            suggested_laws = re.sub(r'[\*\-]', '', suggested_laws).replace('**', '')
-            recommended_actions = re.sub(r'[\*\-]', '', recommended_actions).replace('**', '')
+    def launch_next():
+        candidate = next(candidates, None)
+        if candidate:
+            tried.append(candidate)
+            pending.add(asyncio.create_task(ask_model(candidate, prompt, estimated_tokens)))
 
-            return suggested_laws, recommended_actions
+    # Hedged fallback: the next model starts when an attempt fails or is still
+    # running after GEMINI_HEDGE_DELAY; the first answer wins, the rest are cancelled
+    launch_next()
+    try:
+        while pending and result is None:
+            done, _ = await asyncio.wait(pending, timeout=GEMINI_HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED)
+            pending.difference_update(done)
+            if not done:
+                launch_next()
+                continue
+            for task in done:
+                if task.exception() is None:
+                    result = result or task.result()
+                else:
+                    last_exception = task.exception()
+                    launch_next()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if result is None:
+        guidance = (
+            "Analysis failed: Could not reach a supported model. "
+            "Make sure your API key is correct and the model name is available."
+        )
+        print(f"AI analysis error after trying models {tried}: {last_exception}")
+        return guidance, "Try again later"
 
-        except Exception as e:
-            last_exception = e
-            print(f"AI attempt with model '{candidate}' failed: {e}")
-            continue
+    suggested_laws, recommended_actions = result
+    await store_cached_analysis(cache_key, suggested_laws, recommended_actions)
+    return suggested_laws, recommended_actions
 
-    guidance = (
-        "Analysis failed: Could not reach a supported model. "
-        "Make sure your API key is correct and the model name is available."
-    )
-    print(f"AI analysis error after trying models {tried}: {last_exception}")
-    return guidance, "Try again later"
+# Caps running background analyses (new FIRs and retries); keep it at or below WORKER_RPM
+ANALYSIS_CONCURRENCY = int(os.getenv("ANALYSIS_CONCURRENCY", "10"))
+analysis_semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
 
 # ---------------- File FIR ----------------
 @app.route("/report", methods=["GET", "POST"])
-def report():
+async def report():
     if "user_id" not in session:
-        flash("Please login first.", "error")
+        await flash("Please login first.", "error")
         return redirect(url_for("login"))
 
     if request.method == "POST":
-        description = request.form.get("description")
-        suggested_laws, recommended_actions = analyze_fir(description)
-
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO fir_reports (
-                user_id, name, company, company_address, industry, email, phone, 
-                accused_name, accused_role, witness_name, witness_contact, location_details, 
-                violation_type, incident_date, description, status, laws, actions
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        form = await request.form
+        description = form.get("description")
+
+        conn = await get_db_connection()
+        fir_id = await insert_firs(conn, [(
             session['user_id'],
-            request.form.get("full_name"),
-            request.form.get("company_name"),
-            request.form.get("company_address"),
-            request.form.get("industry"),
-            request.form.get("email"),
-            request.form.get("phone"),
-            request.form.get("accused_name"),
-            request.form.get("accused_role"),
-            request.form.get("witness_name"),
-            request.form.get("witness_contact"),
-            request.form.get("location_details"),
-            request.form.get("violation_type"),
-            request.form.get("incident_date"),
+            form.get("full_name"),
+            form.get("company_name"),
+            form.get("company_address"),
+            form.get("industry"),
+            form.get("email"),
+            form.get("phone"),
+            form.get("accused_name"),
+            form.get("accused_role"),
+            form.get("witness_name"),
+            form.get("witness_contact"),
+            form.get("location_details"),
+            form.get("violation_type"),
+            form.get("incident_date"),
             description,
-            "Analyzed",
-            suggested_laws,
-            recommended_actions
-        ))
-        conn.commit()
-        conn.close()
-
-        flash("FIR submitted successfully!", "success")
+            "Analyzing",
+            None,
+            None,
+            int(time.time())
+        )])
+
+        # Gemini can take many seconds; answer now and let the dashboard poll
+        app.add_background_task(finish_analysis, fir_id, description)
+        await flash("FIR submitted successfully! AI analysis is running in the background.", "success")
+        return redirect(url_for("dashboard"))
+
+    return await render_template("report.html")
+
+# FIRs this worker has queued that are still waiting on analysis_semaphore
+queued_analyses = set()
+
+async def finish_analysis(fir_id, description):
+    queued_analyses.add(fir_id)
+    try:
+        async with analysis_semaphore:
+            queued_analyses.discard(fir_id)
+            # The stale-analysis clock only starts once the analysis really runs
+            async with db_pool.connection() as conn:
+                await conn.execute("BEGIN IMMEDIATE")
+                await conn.execute("UPDATE fir_reports SET analysis_started_at = ? WHERE id = ?", (int(time.time()), fir_id))
+                await conn.commit()
+            suggested_laws, recommended_actions = await analyze_fir(description)
+    except Exception as e:
+        print(f"Background analysis of FIR {fir_id} failed: {e}")
+        suggested_laws, recommended_actions = f"Analysis failed: {e}", "Try again later"
+    finally:
+        queued_analyses.discard(fir_id)
+    # Runs after the request has finished, so it takes its own pooled connection
+    async with db_pool.connection() as conn:
+        await update_fir_analyses(conn, [("Analyzed", suggested_laws, recommended_actions, fir_id)])
+
+# A running analysis older than this belongs to a worker that died (or is stuck)
+ANALYSIS_STALE_AFTER = int(os.getenv("ANALYSIS_STALE_AFTER", "900"))
+ANALYSIS_SWEEP_INTERVAL = int(os.getenv("ANALYSIS_SWEEP_INTERVAL", "60"))
+
+async def fail_stale_analyses():
+    now = int(time.time())
+    async with db_pool.connection() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        # Queued FIRs can wait on the semaphore for any length of time, so their
+        # worker keeps re-stamping them; only a dead worker's queue goes quiet
+        await conn.executemany(
+            "UPDATE fir_reports SET analysis_queued_at = ? WHERE id = ? AND status = 'Analyzing'",
+            [(now, fir_id) for fir_id in queued_analyses]
+        )
+        await conn.execute(
+            "UPDATE fir_reports SET status = 'Analyzed', laws = ?, actions = ? "
+            "WHERE status = 'Analyzing' AND (analysis_started_at <= ? OR "
+            "(analysis_started_at IS NULL AND (analysis_queued_at IS NULL OR analysis_queued_at <= ?)))",
+            ("Analysis failed: interrupted before it finished.", "Try again later",
+             now - ANALYSIS_STALE_AFTER, now - 3 * ANALYSIS_SWEEP_INTERVAL)
+        )
+        await conn.commit()
+
+@app.while_serving
+async def sweep_stale_analyses():
+    # Every worker sweeps on an interval, so a worker that dies and is respawned
+    # doesn't leave its FIRs "Analyzing" until some later restart
+    async def sweep_forever():
+        while True:
+            try:
+                await fail_stale_analyses()
+            except Exception as e:
+                print(f"Stale analysis sweep failed: {e}")
+            await asyncio.sleep(ANALYSIS_SWEEP_INTERVAL)
+
+    sweeper = asyncio.create_task(sweep_forever())
+    yield
+    sweeper.cancel()
+
+@app.route("/fir/<int:fir_id>/status")
+async def fir_status(fir_id):
+    if "user_id" not in session:
+        return {"error": "Please login first."}, 401
+
+    conn = await get_db_connection()
+    async with conn.execute(
+        "SELECT status, laws, actions FROM fir_reports WHERE id = ? AND user_id = ?",
+        (fir_id, session['user_id'])
+    ) as cursor:
+        fir_row = await cursor.fetchone()
+
+    if not fir_row:
+        return {"error": "FIR not found."}, 404
+    return dict(fir_row)
+
+# ---------------- Re-analyze Failed FIRs ----------------
+@app.route("/reanalyze", methods=["POST"])
+async def reanalyze():
+    if "user_id" not in session:
+        await flash("Please login first.", "error")
+        return redirect(url_for("login"))
+
+    conn = await get_db_connection()
+    # Select and claim in one transaction so a double-submit can't retry a FIR twice
+    await conn.execute("BEGIN IMMEDIATE")
+    rows = await conn.execute_fetchall(
+        "SELECT id, description FROM fir_reports WHERE user_id = ? AND laws LIKE 'Analysis failed%'",
+        (session['user_id'],)
+    )
+    queued_at = int(time.time())
+    await conn.executemany(
+        "UPDATE fir_reports SET status = 'Analyzing', laws = NULL, actions = NULL, "
+        "analysis_queued_at = ?, analysis_started_at = NULL WHERE id = ?",
+        [(queued_at, row['id']) for row in rows]
+    )
+    await conn.commit()
+
+    if not rows:
+        await flash("No failed analyses to retry.", "success")
         return redirect(url_for("dashboard"))
 
-    return render_template("report.html")
+    # Same path as /report: each FIR is written back as soon as its own analysis ends
+    for row in rows:
+        app.add_background_task(finish_analysis, row['id'], row['description'])
+
+    await flash(f"Re-analyzing {len(rows)} FIR(s) in the background.", "success")
+    return redirect(url_for("dashboard"))
 
 # ---------------- Generate PDF ----------------
+# Built once per width; safe_text runs for every field of every PDF
+@lru_cache(maxsize=16)
+def _long_token_re(width):
+    return re.compile(rf"(\S{{{width},}})")
+
+@lru_cache(maxsize=16)
+def _text_wrapper(width):
+    return textwrap.TextWrapper(width=width)
+
 def safe_text(text, width=100):
     if not text:
         return "N/A"
-    text = re.sub(r"(\S{%d,})" % width,
-                  lambda m: " ".join(textwrap.wrap(m.group(0), width)),
-                  text)
-    return "\n".join(textwrap.wrap(text, width))
-
-def generate_fir_pdf(fir_dict):
+    wrapper = _text_wrapper(width)
+    if not any(len(token) >= width for token in text.split()):
+        return "\n".join(wrapper.wrap(text))
+    # Only text with an overlong token (URLs, IDs) needs breaking up first
+    text = _long_token_re(width).sub(lambda m: " ".join(wrapper.wrap(m.group(0))), text)
+    return "\n".join(wrapper.wrap(text))
+
+# --- Fonts (TTF files are read and parsed once at import, not per PDF) ---
+DEJAVU_REGULAR_PATH = "fonts/DejaVuSans.ttf"
+DEJAVU_BOLD_PATH = "fonts/DejaVuSans-Bold.ttf"
+
+def load_dejavu_fonts():
+    if not (os.path.exists(DEJAVU_REGULAR_PATH) and os.path.exists(DEJAVU_BOLD_PATH)):
+        raise FileNotFoundError("DejaVu fonts not found.")
     pdf = FPDF()
+    pdf.add_font("DejaVu", "", DEJAVU_REGULAR_PATH)
+    pdf.add_font("DejaVu", "B", DEJAVU_BOLD_PATH)
+    font_bytes = {font.ttffile: font.ttffile.read_bytes() for font in pdf.fonts.values()}
+    return pdf.fonts, font_bytes
+
+try:
+    LOADED_FONTS, LOADED_FONT_BYTES = load_dejavu_fonts()
+    REGULAR_FONT = ("DejaVu", "")
+    BOLD_FONT = ("DejaVu", "B")
+except Exception as e:
+    print(f"Font fallback: {e}")
+    LOADED_FONTS, LOADED_FONT_BYTES = {}, {}
+    REGULAR_FONT = ("Helvetica", "")
+    BOLD_FONT = ("Helvetica", "B")
+
+# _clone_font reproduces fpdf2 internals checked against this release only (for
+# concurrent renders too: see check_pdf_render.py); on any other version fall
+# back to add_font, which is slower but can't subset wrongly
+CLONE_FONTS_FPDF_VERSION = "2.7.9"
+
+class TemplatePDF(FPDF):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if FPDF_VERSION == CLONE_FONTS_FPDF_VERSION:
+            for fontkey, font in LOADED_FONTS.items():
+                self.fonts[fontkey] = self._clone_font(font)
+        elif LOADED_FONTS:
+            self.add_font("DejaVu", "", DEJAVU_REGULAR_PATH)
+            self.add_font("DejaVu", "B", DEJAVU_BOLD_PATH)
+
+    def _clone_font(self, font):
+        # Only the read-only parse results (glyph widths, cmap, glyph ids) are
+        # shared. Everything fpdf2 mutates while building a document is per PDF:
+        # output() writes the font name, object id and file reference into desc,
+        # and subsets the fontTools object in place, so each PDF gets its own
+        # descriptor, reopens the TTF (lazily, from the bytes kept in memory) and
+        # gets its own subset, seeded as TTFFont.__init__ seeds it
+        clone = copy.copy(font)
+        clone.desc = copy.copy(font.desc)
+        clone.ttfont = ttLib.TTFont(
+            io.BytesIO(LOADED_FONT_BYTES[font.ttffile]), recalcTimestamp=False, fontNumber=0, lazy=True
+        )
+        seed = "\x00 \r\n"
+        if self.str_alias_nb_pages:
+            seed += "0123456789" + self.str_alias_nb_pages
+        clone.subset = SubsetMap(clone, [ord(char) for char in seed])
+        clone.missing_glyphs = []
+        clone.hbfont = None
+        return clone
+
+PDF_FIELDS = [
+    ("Complainant", "name"),
+    ("Email", "email"),
+    ("Phone", "phone"),
+    ("Accused", "accused_name"),
+    ("Role", "accused_role"),
+    ("Incident Date", "incident_date"),
+    ("Location", "location_details"),
+    ("Violation Type", "violation_type"),
+    ("Description", "description"),
+    ("Company", "company"),
+    ("Company Address", "company_address"),
+    ("Industry", "industry"),
+    ("Suggested Laws", "laws"),
+    ("Recommended Actions", "actions")
+]
+# download_fir selects exactly these columns, in this order
+PDF_COLUMNS = ", ".join(key for _, key in PDF_FIELDS)
+
+def generate_fir_pdf(fir_row):
+    # fir_row is the sqlite3.Row itself; no dict copy of the whole report
+    fields = [(label, key, safe_text(fir_row[key])) for label, key in PDF_FIELDS]
+
+    # Pure-ASCII reports use the built-in Helvetica: no TTF to embed or subset
+    if all(text.isascii() for _, _, text in fields):
+        pdf = FPDF()
+        regular_font = ("Helvetica", "")
+        bold_font = ("Helvetica", "B")
+    else:
+        pdf = TemplatePDF()
+        regular_font = REGULAR_FONT
+        bold_font = BOLD_FONT
+    # cp1252 (unlike fpdf2's latin-1 default) has the "•" used for list items
+    pdf.core_fonts_encoding = "windows-1252"
+
     pdf.add_page()
     pdf.set_left_margin(10)
     pdf.set_right_margin(10)
 
-    try:
-        if os.path.exists("fonts/DejaVuSans.ttf") and os.path.exists("fonts/DejaVuSans-Bold.ttf"):
-            pdf.add_font("DejaVu", "", "fonts/DejaVuSans.ttf", uni=True)
-            pdf.add_font("DejaVu", "B", "fonts/DejaVuSans-Bold.ttf", uni=True)
-            regular_font = ("DejaVu", "")
-            bold_font = ("DejaVu", "B")
-        else:
-            raise FileNotFoundError("DejaVu fonts not found.")
-    except Exception as e:
-        print(f"Font fallback: {e}")
-        regular_font = ("Arial", "")
-        bold_font = ("Arial", "B")
-
     pdf.set_font(bold_font[0], bold_font[1], 16)
-    pdf.cell(0, 10, "First Information Report (FIR)", ln=True, align="C")
+    pdf.cell(0, 10, "First Information Report (FIR)", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
     pdf.ln(8)
 
     width = pdf.w - pdf.l_margin - pdf.r_margin
     pdf.set_font(regular_font[0], regular_font[1], 12)
 
-    fields = [
-        ("Complainant", "name"),
-        ("Email", "email"),
-        ("Phone", "phone"),
-        ("Accused", "accused_name"),
-        ("Role", "accused_role"),
-        ("Incident Date", "incident_date"),
-        ("Location", "location_details"),
-        ("Violation Type", "violation_type"),
-        ("Description", "description"),
-        ("Company", "company"),
-        ("Company Address", "company_address"),
-        ("Industry", "industry"),
-        ("Suggested Laws", "laws"),
-        ("Recommended Actions", "actions")
-    ]
-
-    for label, key in fields:
-        text = safe_text(fir_dict.get(key, "N/A"))
+    for label, key, text in fields:
         pdf.set_font(bold_font[0], bold_font[1], 12)
-        pdf.cell(0, 8, f"{label}:", ln=True)
+        pdf.cell(0, 8, f"{label}:", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
         pdf.set_font(regular_font[0], regular_font[1], 12)
         # Handle the list items for PDF generation
         if key in ["laws", "actions"]:
@@ -343,39 +827,83 @@ def generate_fir_pdf(fir_dict):
             pdf.multi_cell(width, 6, text)
         pdf.ln(2)
 
-    # ✅ FIXED — remove encode, handle bytearray directly
-    pdf_bytes = pdf.output(dest="S")
-    if isinstance(pdf_bytes, str):
-        pdf_bytes = pdf_bytes.encode("latin-1")
-    return io.BytesIO(bytes(pdf_bytes))
+    return bytes(pdf.output())
+
+# --- PDF Cache ({fir_id}_{content hash}.pdf, so an edited FIR simply gets a new file) ---
+PDF_CACHE_DIR = os.path.join("cache", "pdfs")
+# Bump when the PDF layout or renderer changes so stale files are not served
+PDF_CACHE_VERSION = 3
+
+def pdf_cache_key(fir_row):
+    # Column order is fixed by PDF_COLUMNS, so the values alone identify the content
+    return hashlib.sha256(repr((PDF_CACHE_VERSION, tuple(fir_row))).encode()).hexdigest()
+
+def cached_fir_pdf(fir_id, fir_row, key):
+    path = os.path.join(PDF_CACHE_DIR, f"{fir_id}_{key}.pdf")
+    # Read the hit here rather than letting send_file open the path later: a
+    # concurrent re-render of this FIR may unlink it in between (then re-render)
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    pdf_bytes = generate_fir_pdf(fir_row)
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    # Unique per process and thread; renders run via asyncio.to_thread
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(pdf_bytes)
+    os.replace(tmp_path, path)
+    # Earlier renders of this FIR can never be served again; don't let them pile up
+    for stale_path in glob.glob(os.path.join(PDF_CACHE_DIR, f"{fir_id}_*.pdf")):
+        if stale_path != path:
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+    return pdf_bytes
 
 # --- Download route ---
 @app.route("/download/<int:fir_id>")
-def download_fir(fir_id):
+async def download_fir(fir_id):
     if "user_id" not in session:
-        flash("Please login first.", "error")
+        await flash("Please login first.", "error")
         return redirect(url_for("login"))
 
-    conn = get_db_connection()
-    fir_row = conn.execute(
-        "SELECT * FROM fir_reports WHERE id = ? AND user_id = ?",
-        (fir_id, session['user_id'])
-    ).fetchone()
-    conn.close()
+    # Released before rendering so slow downloads don't hold pool connections
+    async with db_pool.connection() as conn:
+        async with conn.execute(
+            f"SELECT {PDF_COLUMNS} FROM fir_reports WHERE id = ? AND user_id = ?",
+            (fir_id, session['user_id'])
+        ) as cursor:
+            fir_row = await cursor.fetchone()
 
     if not fir_row:
-        flash("Invalid FIR ID or you do not have permission to download this report.", "error")
+        await flash("Invalid FIR ID or you do not have permission to download this report.", "error")
         return redirect(url_for("dashboard"))
 
-    fir_dict = dict(fir_row)
-    pdf_file = generate_fir_pdf(fir_dict)
-    pdf_file.seek(0)
-    return send_file(pdf_file, download_name=f"FIR_{fir_id}.pdf", as_attachment=True, mimetype="application/pdf")
+    key = pdf_cache_key(fir_row)
+    if key in request.if_none_match:
+        response = Response("", status=304)
+    else:
+        # Rendering is CPU-bound; keep it off the event loop. Concurrent renders in
+        # these threads are safe only because TemplatePDF gives each PDF its own
+        # mutable font state; check_pdf_render.py guards that
+        pdf_bytes = await asyncio.to_thread(cached_fir_pdf, fir_id, fir_row, key)
+        response = Response(pdf_bytes, mimetype="application/pdf", headers={"Content-Disposition": f"attachment; filename=FIR_{fir_id}.pdf"})
+    # Same validators and caching rules on the 200 and the 304
+    response.set_etag(key)
+    # Reports are per-user: let the browser keep a copy but revalidate it via ETag
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 # ---------------- Privacy ----------------
 @app.route("/privacy")
-def privacy():
-    return render_template("privacy.html")
+async def privacy():
+    return await render_template("privacy.html")
 
+# Development server only; production runs under gunicorn with uvicorn workers (see Procfile)
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,32 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from app import PDF_FIELDS, generate_fir_pdf
+
+# download_fir renders in worker threads, so concurrent renders of non-ASCII
+# FIRs (the cloned DejaVu fonts) must match a one-at-a-time render exactly
+RENDERS = 64
+THREADS = 8
+
+def strip_volatile(pdf_bytes):
+    return re.sub(rb"/CreationDate \(.*?\)|/ID \[.*?\]", b"", pdf_bytes)
+
+def fir_row(i):
+    # Varying lengths give each PDF a different page count and object layout
+    return {key: f"Ünïcode résumé ₹ {key} " * (1 + (i % 4) * 40) for _, key in PDF_FIELDS}
+
+def render(row):
+    try:
+        return strip_volatile(generate_fir_pdf(row))
+    except Exception as e:
+        return repr(e)
+
+if __name__ == "__main__":
+    rows = [fir_row(i) for i in range(RENDERS)]
+    expected = [render(row) for row in rows]
+    with ThreadPoolExecutor(THREADS) as pool:
+        results = list(pool.map(render, rows))
+    crashes = sum(isinstance(result, str) for result in results)
+    mismatches = sum(result != want for result, want in zip(results, expected)) - crashes
+    print(f"{RENDERS} concurrent renders: {crashes} crashed, {mismatches} differed from a serial render")
+    raise SystemExit(1 if crashes or mismatches else 0)